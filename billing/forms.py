@@ -1,49 +1,88 @@
 # This file defines classes that render forms that are used to process user input
 
-from collections import OrderedDict
+from copy import deepcopy
+from functools import lru_cache
+from re import compile as re_compile
+from sys import intern
 from django import forms
+from django.core.validators import RegexValidator
 from django.forms import formset_factory
-from macola.models import InvoiceCategory
-from sales_tracking.forms import MonthSelectorField
 
 
 date_input = forms.DateInput(attrs={'type': 'date'})
 text_area = forms.Textarea(attrs={'rows': 1, 'cols': 55})
 small_text_input = forms.TextInput(attrs={'class': 'thin'})
-kind_choices = (
-    ('Credit', 'Credit'),
-    ('Debit', 'Debit'),
-)
-acct_type_choices = (
-    ('Regular Account', 'Regular Account'),
-    ('Correctional Center Account', 'Correctional Center Account'),
-    ('Inmate Benefit Fund Account', 'Inmate Benefit Fund Account'),
-    ('Employee Benefit Fund Account', 'Employee Benefit Fund Account'),
-    ('Department of Transportation Account', 'Department of Transportation Account'),
-    ('DHS Mental Health and DD Center Account', 'DHS Mental Health and DD Center Account'),
-    ('Other State Agency Account', 'Other State Agency Account'),
-    ('University Account', 'University Account'),
-    ('City, County, Village Account', 'City, County, Village Account'),
-    ('Not For Profit Account', 'Not For Profit Account'),
-)
+invoice_no_validator = RegexValidator(re_compile(r'^\d{8}$'), message='Must be exactly 8 digits')
+# Choice values double as their labels, so each pair shares a single interned string
+kind_choices = tuple((kind, kind) for kind in map(intern, ('Credit', 'Debit')))
+acct_type_choices = tuple((acct_type, acct_type) for acct_type in map(intern, (
+    'Regular Account',
+    'Correctional Center Account',
+    'Inmate Benefit Fund Account',
+    'Employee Benefit Fund Account',
+    'Department of Transportation Account',
+    'DHS Mental Health and DD Center Account',
+    'Other State Agency Account',
+    'University Account',
+    'City, County, Village Account',
+    'Not For Profit Account',
+)))
+
+
+class InvoiceNumberField(forms.CharField):
+    default_validators = [invoice_no_validator]
+    default_help_text = 'Must be exactly 8 digits long using format: (<4-DIGIT PREFIX><4-DIGIT SEQUENCE>)'
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('widget', forms.TextInput(attrs={'minlength': 8, 'maxlength': 8}))
+        kwargs.setdefault('help_text', self.default_help_text)
+        super(InvoiceNumberField, self).__init__(**kwargs)
+
+
+# Field prototype that is copied for every invoice category instead of being rebuilt on every instantiation
+invoice_no_field = InvoiceNumberField()
+
+
+def _get_invoice_categories():
+    """
+    Retrieve id, description, and starting invoice number of every invoice category in a single query.
+    Not cached since each invoices run advances the starting numbers, possibly in another worker process
+    :return: tuple
+    """
+    from macola.models import InvoiceCategory
+    cat_qset = InvoiceCategory.objects.order_by('number')
+    return tuple(cat_qset.values_list('id', 'description', 'invoice_start').iterator())
+
+
+@lru_cache(maxsize=128)
+def _get_invoice_no_field_name_label(pk, description):
+    """
+    Build the field name and label for an invoice category's starting invoice number, shared across form instances
+    :param pk: int
+    :param description: str
+    :return: tuple
+    """
+    return intern('start_%s' % pk), intern('Starting %s Invoice Number' % description)
 
 
 class InvoicePeriodForm(forms.Form):
-    def __init__(self, *args, **kwargs):
+    query_by = forms.ChoiceField(choices=(('ship_date', 'Ship Date'), ('enter_date', 'Enter Date')),
+                                 label='Query By', initial='ship_date', widget=forms.RadioSelect,
+                                 help_text='Date field to query by')
+
+    def __init__(self, *args, categories=None, **kwargs):
+        from sales_tracking.forms import MonthSelectorField
         super(InvoicePeriodForm, self).__init__(*args, **kwargs)
-        self.fields.update(period=MonthSelectorField(label='Select Month', help_text='Goes by FISCAL YEAR'))
-        cat_qset = InvoiceCategory.objects.order_by('number')
-        for pk, cat, inv in cat_qset.values_list('id', 'description', 'invoice_start'):
-            fname = 'start_{}'.format(pk)
-            field = forms.CharField(min_length=8, max_length=8, initial=inv,
-                                    label='Starting {} Invoice Number'.format(cat),
-                                    help_text='Must be exactly 8 digits long using format: '
-                                              '(<4-DIGIT PREFIX><4-DIGIT SEQUENCE>)')
-            self.fields.update({fname: field})
-        query_by_choices = zip(('ship_date', 'enter_date'), ('Ship Date', 'Enter Date'))
-        query_by_choicefield = forms.ChoiceField(choices=query_by_choices, label='Query By', initial='ship_date',
-                                                 widget=forms.RadioSelect, help_text='Date field to query by')
-        self.fields.update(query_by=query_by_choicefield)
+        fields, query_by = self.fields, self.fields.pop('query_by')
+        fields['period'] = MonthSelectorField(label='Select Month', help_text='Goes by FISCAL YEAR')
+        if categories is None:
+            categories = _get_invoice_categories()
+        for pk, cat, inv in categories:
+            fname, label = _get_invoice_no_field_name_label(pk, cat)
+            field = deepcopy(invoice_no_field)
+            field.initial, field.label = inv, label
+            fields[fname] = field
+        fields['query_by'] = query_by
 
 
 class InvoiceNumberingForm(forms.Form):
@@ -75,42 +114,36 @@ class MacolaRequestForm(forms.Form):
     req_person = forms.CharField(max_length=30, label='Person Requesting MACOLA Number')
     acct_type = forms.ChoiceField(choices=acct_type_choices, widget=forms.RadioSelect,
                                   label='Type of Account Requested')
-
-    def __init__(self, acct_no=None, *args, **kwargs):
-        super(MacolaRequestForm, self).__init__(*args, **kwargs)
-        if acct_no is None:
-            field_names = ('tax_exemption', 'name', 'inv_addr1', 'inv_addr2', 'inv_city', 'inv_state', 'inv_zip',
-                           'phone', 'fax_No', 'email')
-            form_fields = (
-                forms.CharField(max_length=15, label='Tax Exemption Number', required=False),
-                forms.CharField(max_length=30, label='Account Name'),
-                forms.CharField(max_length=30, label='Address Line 1'),
-                forms.CharField(max_length=30, label='Address Line 2', required=False),
-                forms.CharField(max_length=20, label='City'),
-                forms.CharField(max_length=2, label='State', initial='IL'),
-                forms.CharField(max_length=10, label='Zip Code'),
-                forms.CharField(max_length=15, label='Phone Number'),
-                forms.CharField(max_length=15, label='Fax Number', required=False),
-                forms.EmailField(max_length=30, label='Email Address', required=False),
-            )
-            self.fields.update(OrderedDict(zip(field_names, form_fields)))
-        extra_field_names = ('state_employee', 'agency_loc', 'agency_no', 'fund_no')
-        extra_form_fields = (
-            forms.BooleanField(label='State Employee?', required=False),
-            forms.CharField(max_length=20, label='State Agency Location', initial='Springfield',
-                            help_text="For Employee's Individual Account"),
-            forms.IntegerField(label='Agency Number', initial=426, help_text='426 for ICI'),
-            forms.IntegerField(label='Fund Number', initial=301, help_text='301 for ICI'),
-        )
-        self.fields.update(OrderedDict(zip(extra_field_names, extra_form_fields)))
+    state_employee = forms.BooleanField(label='State Employee?', required=False)
+    agency_loc = forms.CharField(max_length=20, label='State Agency Location', initial='Springfield',
+                                 help_text="For Employee's Individual Account")
+    agency_no = forms.IntegerField(label='Agency Number', initial=426, help_text='426 for ICI')
+    fund_no = forms.IntegerField(label='Fund Number', initial=301, help_text='301 for ICI')
+
+
+class MacolaRequestAddressForm(MacolaRequestForm):
+    field_order = ('req_date', 'req_person', 'acct_type', 'tax_exemption', 'name', 'inv_addr1', 'inv_addr2',
+                   'inv_city', 'inv_state', 'inv_zip', 'phone', 'fax_No', 'email')
+    tax_exemption = forms.CharField(max_length=15, label='Tax Exemption Number', required=False)
+    name = forms.CharField(max_length=30, label='Account Name')
+    inv_addr1 = forms.CharField(max_length=30, label='Address Line 1')
+    inv_addr2 = forms.CharField(max_length=30, label='Address Line 2', required=False)
+    inv_city = forms.CharField(max_length=20, label='City')
+    inv_state = forms.CharField(max_length=2, label='State', initial='IL')
+    inv_zip = forms.CharField(max_length=10, label='Zip Code')
+    phone = forms.CharField(max_length=15, label='Phone Number')
+    fax_No = forms.CharField(max_length=15, label='Fax Number', required=False)
+    email = forms.EmailField(max_length=30, label='Email Address', required=False)
 
 
 class InvoicePathForm(forms.Form):
+    invoice_date = forms.DateField(widget=date_input, label='Invoice Date')
+
     def __init__(self, add_fields=None, *args, **kwargs):
         super(InvoicePathForm, self).__init__(*args, **kwargs)
-        if add_fields is not None:
+        if add_fields:
             self.fields.update(add_fields)
-        self.fields.update(invoice_date=forms.DateField(widget=date_input, label='Invoice Date'))
+            self.order_fields(add_fields)
 
 
 class CreditRequestForm(forms.Form):
@@ -120,6 +153,39 @@ class CreditRequestForm(forms.Form):
     credit_no = forms.IntegerField(label='Credit Request Number')
 
 
-InvoiceFormset = formset_factory(InvoiceNumberingForm, extra=0)
-IncludeJobFormset = formset_factory(IncludeJobForm, extra=0)
-AdjustmentFormset = formset_factory(AdjustmentForm, extra=1)
+@lru_cache(maxsize=32)
+def get_formset(form_class, extra=0, **kwargs):
+    """
+    Build a formset class for the passed-in form class once and reuse it for identical arguments
+    :param form_class: Form class
+    :param extra: int
+    :param kwargs: formset_factory kwargs
+    :return: FormSet class
+    """
+    return formset_factory(form_class, extra=extra, **kwargs)
+
+
+InvoiceFormset = get_formset(InvoiceNumberingForm)
+IncludeJobFormset = get_formset(IncludeJobForm)
+AdjustmentFormset = get_formset(AdjustmentForm, extra=1)
+
+
+class PrefilledIncludeJobFormset(IncludeJobFormset):
+    """
+    Unbound include formset of n checked forms built without per-form initial dicts
+    """
+    include_initial = {'include': True}
+
+    def __init__(self, n, **kwargs):
+        super(PrefilledIncludeJobFormset, self).__init__(**kwargs)
+        self.n = n
+
+    def total_form_count(self):
+        return self.n
+
+    def initial_form_count(self):
+        return self.n
+
+    def _construct_form(self, i, **kwargs):
+        return self.form(auto_id=self.auto_id, prefix=self.add_prefix(i), initial=self.include_initial,
+                         use_required_attribute=False)
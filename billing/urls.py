@@ -1,12 +1,13 @@
 # This file defines URL objects which map URLs to view functions.
 
-from django.conf.urls import url
+from django.urls import path, re_path
 from . import views
 
 app_name = 'billing'
+billing_invoice_view = views.BillingInvoiceFormView.as_view()
 urlpatterns = [
-    url(r'^$', views.BillingInvoiceFormView.as_view(), name='invoice'),
-    url(r'^generate_pdf/$', views.BillingInvoiceFormView.as_view(), name='genpdf'),
-    url(r'^request_macola/(?P<acct>.*)/$', views.MacolaRequestFormView.as_view(), name='request_macola'),
-    url(r'^credit_request/$', views.CreditRequestFormView.as_view(), name='credit_request'),
+    path('', billing_invoice_view, name='invoice'),
+    path('generate_pdf/', billing_invoice_view, name='genpdf'),
+    re_path(r'^request_macola/(?P<acct>.*)/$', views.MacolaRequestFormView.as_view(), name='request_macola'),
+    path('credit_request/', views.CreditRequestFormView.as_view(), name='credit_request'),
 ]
\ No newline at end of file
@@ -20,27 +20,204 @@ from xlsxwriter import Workbook
 
 # Other built-in Python imports
 import os
+import pickle
+from io import BytesIO
 import pandas as pd
 from datetime import timedelta, date
-from copy import deepcopy
+from copy import copy
 from decimal import Decimal as Dec, getcontext as get_decimal_context, ROUND_HALF_UP
 from operator import attrgetter, itemgetter
 from math import ceil
+from itertools import islice, repeat
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from shutil import rmtree
 from re import compile as re_compile
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 # Django imports
 from django.views.generic import FormView
 from django.http import HttpResponse
-from django.forms import FilePathField, Form, formset_factory
+from django.forms import FilePathField, Form
 from . import forms as bf
 from macola.models import MacolaAcct, InvoiceCategory, BillToProvider
 from lab_site_admin.pdf_templates import InvoiceTemplate, InvoiceRegisterTemplate, InvoiceImage, RegisterParagraph
-from lab_site_admin.utils import currency, VISTAR_CONNECTION, get_labsite_db_connection
+from lab_site_admin.utils import currency, VISTAR_CONNECTION
 
 today = date.today()
 get_decimal_context().rounding = ROUND_HALF_UP
 currency_or_blank = lambda v: currency(v, default='')
+to_cents = lambda v: Dec(format(v, '.2f'))
+digits_regex = re_compile(r'(\d+)')
+# Invoice PDFs are built inside a request, so only a few worker processes are spawned regardless of core count
+invoice_build_workers = min(4, os.cpu_count() or 1)
+# Table styles that never change between requests; build a new style with these as parent before adding to them
+register_tablestyle = TableStyle([
+    ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONT', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('INNERGRID', (0, 0), (-1, -1), colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('BOX', (0, 0), (-1, -1), 2, colors.black),
+    ('LINEBELOW', (0, 0), (-1, 0), 2, colors.black),
+])
+info_tablestyle = TableStyle([
+    ('ALIGN', (0, 0), (0, 3), 'RIGHT'),
+    ('FONT', (0, 0), (0, 3), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (1, 3), 9),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+])
+addr_tablestyle = TableStyle([
+    ('FONT', (0, 0), (-1, -1), 'Helvetica-Bold'),
+    ('LINEBELOW', (-1, -2), (-1, -2), 1, colors.black),
+    ('ALIGN', (-1, -2), (-1, -1), 'CENTER'),
+    ('LEFTPADDING', (-1, 0), (-1, -3), 0.75 * inch),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+])
+jobs_tablestyle = TableStyle([
+    ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('LINEBELOW', (0, 0), (-1, 0), 1, colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('LINEBELOW', (0, -1), (-1, -1), 1, colors.black),
+])
+totals_tablestyle = TableStyle([
+    ('FONT', (-2, 0), (-1, -1), 'Helvetica-Bold'),
+    ('ALIGN', (-2, 0), (-2, -1), 'RIGHT'),
+    ('ALIGN', (-1, 0), (-1, -1), 'CENTER'),
+    ('ALIGN', (0, 0), (-3, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+])
+memo_info_tablestyle = TableStyle([
+    ('FONT', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 14),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+])
+credit_adj_tablestyle = TableStyle([
+    ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 14),
+    ('ALIGNMENT', (0, 0), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('LINEBELOW', (0, 0), (-1, 0), 1, colors.black),
+])
+credit_request_adj_tablestyle = TableStyle([
+    ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('ALIGNMENT', (0, 0), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('LINEBELOW', (0, 0), (-1, 0), 1, colors.black),
+])
+macola_request_tablestyle = TableStyle([
+    ('BOX', (0, 3), (-1, 3), 1, colors.black),
+    ('BOX', (0, 5), (-1, 6), 1, colors.black),
+    ('BOX', (0, 8), (-1, 16), 1, colors.black),
+    ('BOX', (0, -4), (-1, -1), 1, colors.black),
+    ('FONT', (0, 0), (-1, 5), 'Helvetica-Bold'),
+    ('FONT', (0, 8), (0, 18), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, -4), (-1, -1), 8),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+])
+# Billing summary cell format properties (header, normal, total, money, and total money) sharing one base
+summary_normal_props = {'font_size': 10, 'text_h_align': 2, 'text_v_align': 2}
+summary_money_props = dict(summary_normal_props, num_format='$#,##0.00_);($#,##0.00)')
+summary_format_props = (
+    dict(summary_normal_props, bold=True, text_wrap=True, top=2, bottom=2, right=2, left=2),
+    summary_normal_props,
+    dict(summary_normal_props, bold=True, num_format='#,##0'),
+    summary_money_props,
+    dict(summary_money_props, bold=True),
+)
+summary_col_headers = (
+    'Invoice No',
+    'Account No',
+    'Shipped To',
+    'Job ID No',
+    'Patient Name',
+    'Frame Style',
+    'Ship Date',
+    'Lens Price',
+    'Frame Price',
+    'Total Price',
+)
+# Paragraph styles are cloned from one sample stylesheet rather than altering a new stylesheet per request
+sample_styles = getSampleStyleSheet()
+billing_styles = {
+    'normal': sample_styles['Normal'].clone('billing_normal', alignment=1, fontSize=8, leading=8),
+    'h1': sample_styles['Heading1'].clone('billing_h1', alignment=1, borderPadding=0),
+    'h2': sample_styles['Heading2'].clone('billing_h2', alignment=1),
+    'h3': sample_styles['Heading3'].clone('billing_h3', alignment=1),
+    'h4': sample_styles['Heading4'].clone('billing_h4', alignment=2),
+}
+credit_h2 = billing_styles['h2'].clone('credit_h2', alignment=0)
+macola_request_h1 = sample_styles['Heading1'].clone('macola_request_h1', alignment=1)
+credit_request_h2 = sample_styles['Heading2'].clone('credit_request_h2', spaceBefore=0.5 * inch, alignment=4)
+credit_request_h4 = sample_styles['Heading4'].clone('credit_request_h4', alignment=2)
+
+
+@lru_cache(maxsize=32)
+def _get_paragraph_frags(text, style):
+    """
+    Parse the markup of a static paragraph once
+    :param text: str
+    :param style: ParagraphStyle
+    :return: list
+    """
+    return P(text, style).frags
+
+
+def static_paragraph(text, style):
+    """
+    Build a new paragraph for text that never changes between requests, reusing its parsed fragments
+    :param text: str
+    :param style: ParagraphStyle
+    :return: Paragraph
+    """
+    return P(text, style, frags=_get_paragraph_frags(text, style))
+
+
+def build_invoice_file(invoice_path, story_data, doc_kwargs):
+    """
+    Build and save a single account's invoice PDF, defined at module level so it can run in a worker process
+    :param invoice_path: str
+    :param story_data: bytes, pickled story
+    :param doc_kwargs: dict
+    :return: None
+    """
+    InvoiceTemplate(invoice_path, **doc_kwargs).build(pickle.loads(story_data))
+
+
+@lru_cache(maxsize=4)
+def _load_cached_data(cache_path, mtime, cat_id=None, columns=None):
+    """
+    Read cached data from Parquet dataset once per dataset modification time, category, and column selection
+    :param cache_path: str
+    :param mtime: float
+    :param cat_id: int
+    :param columns: tuple
+    :return: DataFrame
+    """
+    filters = None if cat_id is None else [('cat', '=', cat_id)]
+    columns = None if columns is None else list(columns)
+    cached_df = pd.read_parquet(cache_path, engine='pyarrow', columns=columns, filters=filters)
+    if 'cat' in cached_df:
+        # Partition keys are read back as categoricals
+        cached_df['cat'] = cached_df['cat'].astype('int64')
+    return cached_df
+
+
+def attachment_response(buffer, filename, content_type='application/pdf'):
+    """
+    Build an attachment response from a fully written in-memory file so it is sent in a single write
+    :param buffer: BytesIO
+    :param filename: str
+    :param content_type: str
+    :return: HttpResponse
+    """
+    content = buffer.getvalue()
+    response = HttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename={}'.format(filename)
+    response['Content-Length'] = len(content)
+    return response
 
 
 class BillingAppViewMixin:
@@ -77,6 +254,14 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
     proxy_invoice_dir = '/home/proxyserver/clerks/exports/'
     AIS_acct_no = '1000426986279402'
     SAP_acct_no = '9001087365'
+    vistar_arraysize = 10000
+    # Sidecar of each category's account order, matching the order invoice numbers are assigned in
+    acct_order_filename = 'billing_acct_order.pickle'
+    # Cached columns needed to generate registers, invoices, summaries, and credit requests
+    cached_columns = [
+        'provider', 'acct', 'job_id', 'enter_date', 'frame_name', 'frame_item_no', 'frame_name2', 'comment1',
+        'ship_date', 'patient_name', 'lens_price', 'frame_price', 'sales', 'tax', 'total',
+    ]
 
     @staticmethod
     def get_vistar_billing_df(clean_data):
@@ -96,52 +281,85 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
                 vjd.comment1,
                 nvl(to_char(vjd.ship_date, 'mm/dd/yyyy'), 'N/A') as ship_date,
                 vjd.patient_last_name || ', ' || vjd.patient_first_name as patient_name,
-                (select nvl(sum(amt), 0) from prism.vlm_job_item
-                 where job_id = vjd.job_id and item_type = 'L') as lens_price,
-                (select nvl(sum(amt), 0) from prism.vlm_job_item
-                 where job_id = vjd.job_id and item_type in ('F', 'V')) as frame_price,
-                vjd.job_net as sales,
+                nvl(vji.lens_price, 0) as lens_price,
+                nvl(vji.frame_price, 0) as frame_price,
+                vjd.job_net as sales
             from prism.vlm_job_detail vjd
             inner join prism.lm_job lj on vjd.job_id = lj.job_id
             inner join prism.v_jobqry vjq on vjd.job_id = vjq.job_id
+            left join (
+                select
+                    job_id,
+                    sum(case when item_type = 'L' then amt end) as lens_price,
+                    sum(case when item_type in ('F', 'V') then amt end) as frame_price
+                from prism.vlm_job_item
+                where item_type in ('L', 'F', 'V')
+                    and job_id in (
+                        select job_id
+                        from prism.vlm_job_detail
+                        where to_char({query_by}, 'yyyy-mm') = '{end_period}'
+                    )
+                group by job_id
+            ) vji on vjd.job_id = vji.job_id
             where to_char({query_by}, 'yyyy-mm') = '{end_period}'
                 and vjd.bill_customer_no not in ('1', '2', '3')
                 and vjd.job_net > 0
               """.format(**clean_data)
-        return pd.read_sql_query(sql, VISTAR_CONNECTION)
+        # Fetching on the engine's underlying DBAPI cursor with a large array size so rows come back in a few
+        # round trips instead of 100 at a time, closing the raw connection hands it back to the engine's pool
+        raw_connection = VISTAR_CONNECTION.raw_connection()
+        try:
+            cursor = raw_connection.cursor()
+            cursor.arraysize = BillingInvoiceFormView.vistar_arraysize
+            try:
+                cursor.execute(sql)
+                columns = [desc[0].lower() for desc in cursor.description]
+                return pd.DataFrame.from_records(cursor.fetchall(), columns=columns, coerce_float=True)
+            finally:
+                cursor.close()
+        finally:
+            raw_connection.close()
     
-    def get_macola_df(self):
+    @staticmethod
+    def get_macola_df():
         """
-        Build a dataframe of MACOLA accounts
+        Build a dataframe of MACOLA accounts through Django's persistent Lab Site DB connection
         :return: DataFrame
         """
-        sql = """
-            select
-                ma.account_No as acct,
-                ma.bt_provider_id as provider,
-                ma.tax_rate
-            from macola_accounts ma
-              """
-        connection = get_labsite_db_connection(on_localhost=self.on_localhost())
-        return pd.read_sql_query(sql, connection)
+        acct_rows = MacolaAcct.objects.values_list('account_No', 'bt_provider_id', 'tax_rate').iterator()
+        return pd.DataFrame.from_records(acct_rows, columns=['acct', 'provider', 'tax_rate'], coerce_float=True)
     
-    def get_cache_path(self):
+    def get_cache_path(self, filename='billing_data.parquet'):
         """
-        Retrieve path for HDF data file
+        Retrieve path for Parquet dataset directory or one of its sidecar files
+        :param filename: str
         :return: str
         """
-        filename = 'billing_data.h5'
         if self.on_localhost():
             return os.path.join(os.environ['PWD'], 'billing/static/billing/', filename)
         return os.path.join(self.proxy_static_dir, filename)
     
-    def get_cached_data(self):
+    def get_cached_data(self, cat_id=None, columns=None):
         """
-        Retrieve cached data from HDF file
+        Retrieve cached data from Parquet dataset, only reading the partition of the passed-in category if any.
+        Reads are memoized in-process until the dataset is rewritten, so a shallow copy is returned. A category's rows
+        keep the provider and account sort order they were written in, so callers group them with sort=False
+        :param cat_id: int
+        :param columns: list
         :return: DataFrame
         """
-        with pd.HDFStore(self.get_cache_path()) as hdf_store:
-            return hdf_store['billing_data']
+        cache_path = self.get_cache_path()
+        columns = None if columns is None else tuple(columns)
+        return _load_cached_data(cache_path, os.path.getmtime(cache_path), cat_id, columns).copy(deep=False)
+    
+    def get_cached_acct_order(self, cat_id):
+        """
+        Retrieve account numbers of the passed-in category in the order they were rendered in the form template
+        :param cat_id: int
+        :return: list
+        """
+        with open(self.get_cache_path(self.acct_order_filename), 'rb') as acct_order_file:
+            return pickle.load(acct_order_file)[cat_id]
     
     def get_savepath_kwargs(self):
         """
@@ -160,43 +378,65 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
         Retrieve ICI account if it exists
         :return: Model instance or None
         """
-        ici = MacolaAcct.objects.filter(account_No='ici')
-        return ici.first() if ici.exists() else None
+        return MacolaAcct.objects.filter(account_No='ici').first()
     
     @staticmethod
-    def get_object(queryset, pk):
+    def get_object(objects, pk):
         """
-        Get object from passed-in primary key
-        :param queryset: QuerySet
+        Get a copy of the object with the passed-in primary key from a dict built by QuerySet.in_bulk, so that
+        totals set on it do not leak into other groups sharing the same object
+        :param objects: dict
         :param pk: str
         :return: Model instance or None
         """
-        qs = queryset.filter(pk=pk)
-        return qs.first() if qs.exists() else None
+        return copy(objects.get(pk))
     
     @staticmethod
-    def set_totals(obj, data_df):
+    def set_totals(obj, sales_sum, tax_sum):
         """
-        Set sales, tax, and totals for passed-in objects
+        Set sales, tax, and totals for passed-in objects as Decimals rounded to cents
         :param obj: Model instance
-        :param data_df: DataFrame
+        :param sales_sum: float
+        :param tax_sum: float
         :return: None
         """
         if obj is not None:
-            sales_sum, tax_sum = data_df.sales.sum(), data_df.tax.sum()
-            obj.sales = sales_sum
-            obj.tax = tax_sum
-            obj.total = sales_sum + tax_sum
+            obj.sales = to_cents(sales_sum)
+            obj.tax = to_cents(tax_sum)
+            obj.total = obj.sales + obj.tax
+    
+    @staticmethod
+    def write_summary_job(ws, row, acct_info, job):
+        """
+        Write a billing summary job row with type-specific calls for the account info strings and job prices, only
+        leaving XlsxWriter to dispatch on the job fields that may be blank
+        :param ws: Worksheet
+        :param row: int
+        :param acct_info: tuple of strings, nulls already replaced with empty strings
+        :param job: tuple
+        :return: None
+        """
+        invoice_no, acct_no, name = acct_info
+        job_id, patient_name, disp_frame, ship_date, lens_price, frame_price, sales = job
+        ws.write_string(row, 0, invoice_no)
+        ws.write_string(row, 1, acct_no)
+        ws.write_string(row, 2, name)
+        ws.write(row, 3, job_id)
+        ws.write(row, 4, patient_name)
+        ws.write(row, 5, disp_frame)
+        ws.write(row, 6, ship_date)
+        ws.write_number(row, 7, lens_price)
+        ws.write_number(row, 8, frame_price)
+        ws.write_number(row, 9, sales)
     
     @staticmethod
     def convert_to_currency(adjustment):
         """
-        Change last value in list to currency string
-        :param adjustment: list
-        :return: list
+        Change last value in row to currency string
+        :param adjustment: tuple
+        :return: tuple
         """
-        *other, amount = adjustment
-        return [*other, currency_or_blank(amount)]
+        return adjustment[:-1] + (currency_or_blank(adjustment[-1]),)
     
     def get_billing_data(self, clean_data, from_cache=False):
         """
@@ -209,52 +449,77 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
             merged = self.get_cached_data()
         else:
             merged = pd.merge(self.get_vistar_billing_df(clean_data), self.get_macola_df(), on='acct')
-            merged.tax_rate.fillna(0, inplace=True)
-            merged.provider.fillna(0, inplace=True)
-            merged['tax'] = merged.sales * merged.tax_rate
-            merged['total'] = (1 + merged.tax_rate) * merged.sales
-            merged.sort_values(by=['cat', 'provider', 'acct', 'ship_date', 'patient_name'], inplace=True)
-            merged.to_hdf(self.get_cache_path(), key='billing_data')
-        get_object, set_totals = attrgetter('get_object', 'set_totals')(self)
-        all_inv_cats, all_providers = InvoiceCategory.objects.all(), BillToProvider.objects.all()
-        all_accts, billing_data, form_fieldname = MacolaAcct.objects.all(), [], 'start_{}'
+            tax_rate, sales = merged.tax_rate.fillna(0).values, merged.sales.values
+            sales_tax = sales * tax_rate
+            merged = merged.assign(tax_rate=tax_rate, provider=merged.provider.fillna(0), tax=sales_tax,
+                                   total=sales + sales_tax)
+            # Group keys as categoricals let sorting and grouping work on integer codes
+            merged = merged.astype({'cat': 'category', 'provider': 'category', 'acct': 'category'})
+            merged = merged.sort_values(by=['cat', 'provider', 'acct', 'ship_date', 'patient_name'])
+            # Clearing out the previous dataset since pyarrow adds files to existing partitions
+            cache_path = self.get_cache_path()
+            rmtree(cache_path, ignore_errors=True)
+            merged.to_parquet(cache_path, engine='pyarrow', index=False, partition_cols=['cat'])
+            cat_accts = merged.groupby('cat', observed=True, sort=False).acct.unique()
+            acct_order = {cat_id: accts.tolist() for cat_id, accts in cat_accts.items()}
+            with open(self.get_cache_path(self.acct_order_filename), 'wb') as acct_order_file:
+                pickle.dump(acct_order, acct_order_file, pickle.HIGHEST_PROTOCOL)
+        get_object, set_totals = self.get_object, self.set_totals
+        # Only fetching the categories, providers, and accounts that have billing data
+        all_inv_cats = InvoiceCategory.objects.in_bulk(merged.cat.unique().tolist())
+        all_providers = BillToProvider.objects.in_bulk(merged.provider.unique().tolist())
+        all_accts = MacolaAcct.objects.in_bulk(merged.acct.unique().tolist())
+        billing_data, form_fieldname = [], 'start_{}'
         savepath_kwargs = dict(self.get_savepath_kwargs(), initial={'invoice_date': clean_data['end']})
-        for inv_cat_id, inv_cat_df in merged.groupby('cat'):
-            inv_cat_obj = get_object(all_inv_cats, inv_cat_id)
-            set_totals(inv_cat_obj, inv_cat_df)
-            invoice_start = clean_data[form_fieldname.format(inv_cat_obj.number)]
-            prefix, sequence, fmt = invoice_start[:-4], int(invoice_start[-4:]), '{}{:0>4}'
-            sequence_range = range(sequence, sequence + len(inv_cat_df.acct.drop_duplicates()))
-            invoice_no_range = tuple(map(lambda v: fmt.format(prefix, v), sequence_range))
-            invoice_initial = [{'invoice_no': inv_no} for inv_no in invoice_no_range]
-            invoice_no_prefix = '{}_inv'.format(inv_cat_id)
-            invoice_no_formset = bf.InvoiceFormset(initial=invoice_initial, prefix=invoice_no_prefix)
-            invoice_no_forms = invoice_no_formset.forms
-            inv_cat_obj.invoice_no_manager = invoice_no_formset.management_form
-            inv_cat_obj.savepath_form = bf.InvoicePathForm(**savepath_kwargs)
-            inv_cat_obj.has_providers = (inv_cat_df.provider != 0).any()
-            invoice_no_idx, inv_cat_obj.macolas_needed = 0, 0
-            for provider_id, provider_df in inv_cat_df.groupby('provider'):
+        # Aggregating totals for every category, provider, and account in one pass over the sorted data
+        acct_groups = merged.groupby(['cat', 'provider', 'acct'], observed=True, sort=False)
+        acct_totals = acct_groups[['sales', 'tax']].sum()
+        acct_totals['jobs'] = acct_groups.size()
+        cat_totals = acct_totals[['sales', 'tax']].groupby(level='cat', observed=True, sort=False).sum()
+        cat_acct_counts = acct_totals.groupby(level='cat', observed=True, sort=False).size()
+        provider_groups = acct_totals[['sales', 'tax']].groupby(level=['cat', 'provider'], observed=True, sort=False)
+        provider_totals = provider_groups.sum()
+        # Rows are emitted in the same order as the groups above since merged is sorted by those keys
+        # Job rows are tuples whose group key columns are swapped out for their model instances
+        job_columns = [col for col in merged.columns if col not in ('acct', 'provider', 'cat')]
+        Job = namedtuple('Job', job_columns + ['acct', 'provider', 'cat', 'include_form'])
+        job_rows = merged[job_columns].itertuples(index=False, name=None)
+        last_cat_id = last_provider_key = None
+        for (inv_cat_id, provider_id, acct_no), acct_sales, acct_tax, job_count in acct_totals.itertuples():
+            if inv_cat_id != last_cat_id:
+                last_cat_id = inv_cat_id
+                inv_cat_obj = get_object(all_inv_cats, inv_cat_id)
+                set_totals(inv_cat_obj, *cat_totals.loc[inv_cat_id])
+                invoice_start = clean_data[form_fieldname.format(inv_cat_obj.number)]
+                prefix, sequence, fmt = invoice_start[:-4], int(invoice_start[-4:]), '{}{:0>4}'
+                sequence_range = range(sequence, sequence + cat_acct_counts[inv_cat_id])
+                invoice_no_range = tuple(map(lambda v: fmt.format(prefix, v), sequence_range))
+                invoice_initial = [{'invoice_no': inv_no} for inv_no in invoice_no_range]
+                invoice_no_prefix = '{}_inv'.format(inv_cat_id)
+                invoice_no_formset = bf.InvoiceFormset(initial=invoice_initial, prefix=invoice_no_prefix)
+                invoice_no_forms = invoice_no_formset.forms
+                inv_cat_obj.invoice_no_manager = invoice_no_formset.management_form
+                inv_cat_obj.savepath_form = bf.InvoicePathForm(**savepath_kwargs)
+                inv_cat_obj.has_providers = False
+                invoice_no_idx, inv_cat_obj.macolas_needed = 0, 0
+            if (inv_cat_id, provider_id) != last_provider_key:
+                last_provider_key = (inv_cat_id, provider_id)
                 provider_obj = get_object(all_providers, provider_id)
-                set_totals(provider_obj, provider_df)
-                for acct_no, acct_df in provider_df.groupby('acct'):
-                    include_initial = [{'include': True}] * len(acct_df)
-                    include_prefix = '{}_inc'.format(acct_no)
-                    include_formset = bf.IncludeJobFormset(initial=include_initial, prefix=include_prefix)
-                    adj_prefix = '{}_adj'.format(acct_no)
-                    adj_formset = bf.AdjustmentFormset(prefix=adj_prefix)
-                    acct_obj = get_object(all_accts, acct_no)
-                    set_totals(acct_obj, acct_df)
-                    acct_obj.invoice_no_form = invoice_no_forms[invoice_no_idx]
-                    acct_obj.adj_formset = adj_formset
-                    acct_obj.include_manager = include_formset.management_form
-                    if provider_obj is None and not acct_obj.macola_No:
-                        inv_cat_obj.macolas_needed += 1
-                    invoice_no_idx += 1
-                    for include_form, job_dict in zip(include_formset, acct_df.to_dict(orient='records')):
-                        job_dict.update(acct=acct_obj, provider=provider_obj, cat=inv_cat_obj,
-                                        include_form=include_form)
-                        billing_data.append(job_dict)
+                set_totals(provider_obj, *provider_totals.loc[last_provider_key])
+                inv_cat_obj.has_providers = inv_cat_obj.has_providers or provider_id != 0
+            include_formset = bf.PrefilledIncludeJobFormset(job_count, prefix='{}_inc'.format(acct_no))
+            adj_prefix = '{}_adj'.format(acct_no)
+            adj_formset = bf.AdjustmentFormset(prefix=adj_prefix)
+            acct_obj = get_object(all_accts, acct_no)
+            set_totals(acct_obj, acct_sales, acct_tax)
+            acct_obj.invoice_no_form = invoice_no_forms[invoice_no_idx]
+            acct_obj.adj_formset = adj_formset
+            acct_obj.include_manager = include_formset.management_form
+            if provider_obj is None and not acct_obj.macola_No:
+                inv_cat_obj.macolas_needed += 1
+            invoice_no_idx += 1
+            for include_form, job in zip(include_formset, islice(job_rows, job_count)):
+                billing_data.append(Job(*job, acct_obj, provider_obj, inv_cat_obj, include_form))
         return billing_data
     
     @staticmethod
@@ -272,13 +537,13 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
             filtered = [data for data in clean_data if data]
             if not filtered:
                 return None
-            clean_data = pd.DataFrame(filtered)
+            if field_name is not None and field_name in filtered[0]:
+                return pd.Series([data[field_name] for data in filtered], name=field_name)
             if isinstance(bound_form, bf.AdjustmentFormset):
+                clean_data = pd.DataFrame(filtered, columns=['kind', 'ref', 'des', 'amount'])
                 clean_data['amount'] = clean_data['amount'] * clean_data.kind.map({'Credit': -1, 'Debit': 1})
-                clean_data = clean_data.reindex_axis(['kind', 'ref', 'des', 'amount'], axis=1)
-            if field_name is None or field_name not in clean_data:
                 return clean_data
-            return clean_data[field_name]
+            return pd.DataFrame(filtered)
         return bound_form
     
     def form_valid(self, form):
@@ -314,7 +579,7 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
             return super(BillingInvoiceFormView, self).post(request, *args, **kwargs)
         # Setting some general attributes and validating some forms
         cat_id = int(post_data['cat_id'])
-        self.category_obj = self.get_object(InvoiceCategory.objects.filter(pk=cat_id), cat_id)
+        self.category_obj = InvoiceCategory.objects.filter(pk=cat_id).first()
         inv_formset = bf.InvoiceFormset(data=post_data, prefix='{}_inv'.format(cat_id))
         invoice_no_list = validate_form(inv_formset, field_name='invoice_no').tolist()
         savepath_form = bf.InvoicePathForm(data=post_data, **self.get_savepath_kwargs())
@@ -322,18 +587,14 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
         if isinstance(savepath_clean_data, Form):
             return self.form_invalid(savepath_clean_data)
         self.savepath_clean_data = savepath_clean_data
-        self.all_providers, self.all_accounts = BillToProvider.objects.all(), MacolaAcct.objects.all()
-        # Creating general styling objects
-        styles = getSampleStyleSheet()
-        normal, h1, h2, h3, h4 = itemgetter('Normal', 'Heading1', 'Heading2', 'Heading3', 'Heading4')(styles)
-        h4.alignment, normal.fontSize, normal.leading = 2, 8, 8
-        h1.alignment = h2.alignment = h3.alignment = normal.alignment = 1
-        h1.borderPadding = 0
-        [setattr(self, k, v) for k, v in zip(['normal', 'h1', 'h2', 'h3', 'h4'], [normal, h1, h2, h3, h4])]
+        # Setting general styling objects
+        vars(self).update(billing_styles)
         # Filtering cached billing data
-        billing_data, include_job_mask, adjustments, invoice_nos = self.get_cached_data(), [], {}, {}
-        billing_data = billing_data[billing_data.cat == cat_id]
-        for acct_no, invoice_no in zip(billing_data.acct.drop_duplicates(), invoice_no_list):
+        billing_data = self.get_cached_data(cat_id=cat_id, columns=self.cached_columns)
+        self.all_providers = BillToProvider.objects.in_bulk(billing_data.provider.unique().tolist())
+        self.all_accounts = MacolaAcct.objects.in_bulk(billing_data.acct.unique().tolist())
+        include_job_mask, adjustments, invoice_nos = [], {}, {}
+        for acct_no, invoice_no in zip(self.get_cached_acct_order(cat_id), invoice_no_list):
             include_formset = bf.IncludeJobFormset(data=post_data, prefix='{}_inc'.format(acct_no))
             include_job_mask.extend(validate_form(include_formset, field_name='include').tolist())
             adj_formset = bf.AdjustmentFormset(data=post_data, prefix='{}_adj'.format(acct_no))
@@ -351,79 +612,73 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
         :param invoice_nos: dict
         :return: HttpResponse
         """
-        table_style = TableStyle([
-            ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONT', (0, -1), (-1, -1), 'Helvetica-Bold'),
-            ('INNERGRID', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('BOX', (0, 0), (-1, -1), 2, colors.black),
-            ('LINEBELOW', (0, 0), (-1, 0), 2, colors.black),
-        ])
-        inv_no_regex = re_compile(r',')
-        get_object, set_totals = attrgetter('get_object', 'set_totals')(self)
-        all_providers, all_accounts = attrgetter('all_providers', 'all_accounts')(self)
+        table_style = TableStyle(parent=register_tablestyle)
+        get_object, set_totals = self.get_object, self.set_totals
+        all_providers, all_accounts = self.all_providers, self.all_accounts
         table_data = [['Invoice No', 'Account Description', 'Sales', 'Sales Tax', 'Adjustments', 'Total']]
-        row, total_adjs, included_accts = 1, [], [k for k, v in invoice_nos.items() if v]
-        for provider_id, provider_df in billing_data.groupby('provider'):
+        row, included_accts = 1, [k for k, v in invoice_nos.items() if v]
+        # Aggregating account and provider subtotals for included accounts up front
+        included_df = billing_data[billing_data.acct.isin(included_accts)]
+        acct_agg = included_df.groupby(['provider', 'acct'], observed=True, sort=False)[['sales', 'tax']].sum()
+        acct_adjs = {acct_no: adj_df.amount.sum() if isinstance(adj_df, pd.DataFrame) else 0
+                     for acct_no, adj_df in adjustments.items()}
+        provider_ids = billing_data.provider.unique().tolist()
+        provider_agg = acct_agg.groupby(level='provider', observed=True, sort=False).sum()
+        provider_agg = provider_agg.reindex(provider_ids, fill_value=0)
+        # Looking adjustments up per account number since mapping the categorical acct level yields a categorical
+        acct_adj_series = pd.Series([acct_adjs.get(acct_no, 0) for acct_no in acct_agg.index.get_level_values('acct')],
+                                    index=acct_agg.index, dtype=object)
+        adj_by_provider = acct_adj_series.groupby(level='provider', observed=True, sort=False).sum()
+        adj_by_provider = adj_by_provider.reindex(provider_ids, fill_value=0)
+        for provider_id in provider_ids:
             provider_obj = get_object(all_providers, provider_id)
-            set_totals(provider_obj, provider_df)
-            prov_adjs = []
-            for acct_no, acct_df in provider_df.groupby('acct'):
-                adj_df = adjustments[acct_no]
-                if acct_no not in included_accts:
-                    continue
-                acct_adjs = adj_df.amount.sum() if isinstance(adj_df, pd.DataFrame) else 0
-                prov_adjs.append(acct_adjs)
+            provider_accts = acct_agg.loc[provider_id].itertuples() if provider_id in acct_agg.index else ()
+            for acct_no, acct_sales, acct_tax in provider_accts:
+                acct_adj = acct_adjs[acct_no]
                 acct_obj = get_object(all_accounts, acct_no)
-                set_totals(acct_obj, acct_df)
+                set_totals(acct_obj, acct_sales, acct_tax)
                 acct_des = '{} - #{}'.format(*attrgetter('name', 'account_No')(acct_obj))
                 email = acct_obj.email
                 acct_des = '{}\n{}'.format(acct_des, email) if email else acct_des
                 table_data.append([
-                    inv_no_regex.sub('\n', invoice_nos[acct_no]),
+                    invoice_nos[acct_no].replace(',', '\n'),
                     acct_des,
                     currency_or_blank(acct_obj.sales),
                     currency_or_blank(acct_obj.tax),
-                    currency_or_blank(acct_adjs),
-                    currency_or_blank(Dec(acct_obj.total) + acct_adjs),
+                    currency_or_blank(acct_adj),
+                    currency_or_blank(acct_obj.total + acct_adj),
                 ])
                 row += 1
-            prov_adj_sum = sum(prov_adjs)
-            total_adjs.append(prov_adj_sum)
             if provider_obj is not None:
-                prov_name = provider_obj.short_name or provider_df.name[:20]
-                included_prov_acct_df = provider_df[provider_df.acct.isin(included_accts)]
+                set_totals(provider_obj, *provider_agg.loc[provider_id])
+                prov_adj_sum = adj_by_provider[provider_id]
                 table_data.append([
                     '',
-                    '{} Subtotals'.format(prov_name),
-                    currency(included_prov_acct_df.sales.sum()),
-                    currency_or_blank(included_prov_acct_df.tax.sum()),
+                    '{} Subtotals'.format(provider_obj.short_name or provider_obj.name[:20]),
+                    currency(provider_obj.sales),
+                    currency_or_blank(provider_obj.tax),
                     currency_or_blank(prov_adj_sum),
-                    currency(Dec(included_prov_acct_df.total.sum()) + prov_adj_sum),
+                    currency(provider_obj.total + prov_adj_sum),
                 ])
                 table_style.add('LINEBELOW', (0, row), (-1, row), 2, colors.black)
                 table_style.add('FONT', (0, row), (-1, row), 'Helvetica-Bold')
                 row += 1
-        included_total_acct_df = billing_data[billing_data.acct.isin(included_accts)]
-        total_adj_sum = sum(total_adjs)
-        sales_sum, tax_sum = included_total_acct_df.sales.sum(), included_total_acct_df.tax.sum()
+        total_adj_sum = sum(adj_by_provider)
+        sales_sum, tax_sum = to_cents(provider_agg.sales.sum()), to_cents(provider_agg.tax.sum())
         table_data.append([
             '',
             'Totals',
             currency(sales_sum),
             currency_or_blank(tax_sum),
             currency_or_blank(total_adj_sum),
-            currency(Dec(sales_sum + tax_sum) + total_adj_sum),
+            currency(sales_sum + tax_sum + total_adj_sum),
         ])
         total_pages = ceil((len(table_data) - 29) / 31) + 1
         # Creating response object
         month_yr = self.savepath_clean_data['invoice_date'].strftime('%B %Y')
-        cat_obj, h1 = attrgetter('category_obj', 'h1')(self)
+        cat_obj, h1 = self.category_obj, self.h1
         cat_des = cat_obj.description
-        response = HttpResponse(content_type='application/pdf')
-        filename = '{} {} Invoice Register.pdf'.format(month_yr, cat_des)
-        response['Content-Disposition'] = 'attachment; filename={}'.format(filename)
+        buffer, filename = BytesIO(), '{} {} Invoice Register.pdf'.format(month_yr, cat_des)
         header_text = '{} Invoice Register<br/>{}'.format(cat_des, month_yr)
         story = [
             RegisterParagraph(header_text, style=h1, total_pages=total_pages),
@@ -431,11 +686,11 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
         ]
         # Building PDF Document Object
         half_inch = 0.5 * inch
-        inv_register_doc = InvoiceRegisterTemplate(response, topMargin=half_inch, bottomMargin=half_inch,
+        inv_register_doc = InvoiceRegisterTemplate(buffer, topMargin=half_inch, bottomMargin=half_inch,
                                                    leftMargin=half_inch, rightMargin=half_inch,
                                                    allowSplitting=True, pagesize=letter, title=filename)
         inv_register_doc.build(story)
-        return response
+        return attachment_response(buffer, filename)
     
     def invoices(self, billing_data, adjustments, invoice_nos):
         """
@@ -447,44 +702,16 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
         :return: HttpResponse
         """
         # Getting general attributes and functions
-        all_providers = all_accounts = attrgetter('all_providers', 'all_accounts')(self)
-        get_object, set_totals = attrgetter('get_object', 'set_totals')(self)
-        sap_acct_no, category_obj = attrgetter('SAP_acct_no', 'category_obj')(self)
+        all_providers, all_accounts = self.all_providers, self.all_accounts
+        get_object, set_totals = self.get_object, self.set_totals
+        sap_acct_no, category_obj = self.SAP_acct_no, self.category_obj
         cat_des = category_obj.description
         ici, savepath_clean_data = self.get_ici_account(), self.savepath_clean_data
         inv_date_obj, save_to = itemgetter('invoice_date', 'save_to')(savepath_clean_data)
         inv_period, inv_date = inv_date_obj.strftime('%B %Y'), inv_date_obj.strftime('%m/%d/%Y')
-        convert_to_currency = self.convert_to_currency
         compute_total_pages = lambda *args: ceil((sum(map(len, args)) - 29) / 48) + 1
         # Initializing styling objects
-        normal, h1, h3 = attrgetter('normal', 'h1', 'h3')(self)
-        info_tablestyle = TableStyle([
-            ('ALIGN', (0, 0), (0, 3), 'RIGHT'),
-            ('FONT', (0, 0), (0, 3), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (1, 3), 9),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 0),
-        ])
-        addr_tablestyle = TableStyle([
-            ('FONT', (0, 0), (-1, -1), 'Helvetica-Bold'),
-            ('LINEBELOW', (-1, -2), (-1, -2), 1, colors.black),
-            ('ALIGN', (-1, -2), (-1, -1), 'CENTER'),
-            ('LEFTPADDING', (-1, 0), (-1, -3), 0.75 * inch),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ])
-        jobs_tablestyle = TableStyle([
-            ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('LINEBELOW', (0, 0), (-1, 0), 1, colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('LINEBELOW', (0, -1), (-1, -1), 1, colors.black),
-        ])
-        totals_tablestyle = TableStyle([
-            ('FONT', (-2, 0), (-1, -1), 'Helvetica-Bold'),
-            ('ALIGN', (-2, 0), (-2, -1), 'RIGHT'),
-            ('ALIGN', (-1, 0), (-1, -1), 'CENTER'),
-            ('ALIGN', (0, 0), (-3, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ])
+        normal, h1, h3 = self.normal, self.h1, self.h3
         # Building general info objects
         image_path, half_inch = self.get_ici_logo_path(), 0.5 * inch
         image_dims = {'width': 1.2 * inch, 'height': half_inch}
@@ -495,6 +722,8 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
             '{} for SAP Users'.format(sap_acct_no),
         ]
         payment_info_paragraph = P('<br/>'.join(ici_info), normal)
+        invoice_header_paragraph = static_paragraph('Illinois Correctional Industries<br/>Invoice', h1)
+        payment_header_paragraph = static_paragraph('<u>SEND PAYMENT TO:</u>', h3)
         info_table_kwargs = {
             'colWidths': (1.1 * inch, 0.7 * inch),
             'rowHeights': 0.2 * inch,
@@ -524,99 +753,111 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
             'pagesize': letter,
             'title': '{} {} Invoices'.format(inv_period, cat_des),
         }
-        stories, inv_no_regex = [], re_compile(r'\d+')
-        # Generating and saving each invoice file
-        for provider_id, provider_df in billing_data.groupby('provider'):
-            provider_obj = get_object(all_providers, provider_id)
-            attr_or_blank = lambda attr: getattr(provider_obj, attr, '')
-            for acct_no, acct_df in provider_df.groupby('acct'):
-                invoice_no = inv_no_regex.findall(invoice_nos[acct_no])
-                if not invoice_no:
-                    continue
-                invoice_no = invoice_no[0]
-                acct_obj = get_object(all_accounts, acct_no)
-                set_totals(acct_obj, acct_df)
-                macola = acct_obj.macola_No if provider_obj is None else provider_obj.macola_No
-                info_table_data = [
-                    ['Invoice Period:', inv_period],
-                    ['Invoice Date:', inv_date],
-                    ['Invoice No:', invoice_no],
-                    ['Customer Account No:', macola],
-                ]
-                # Adding invoice and bill-to addresses
-                inv_addr_args = ('inv_city', 'inv_state', 'inv_zip')
-                addr_table_data = [
-                    ['{} #{}'.format(acct_obj.name, acct_obj.account_No), attr_or_blank('name')],
-                    [acct_obj.inv_addr1, attr_or_blank('inv_addr1')],
-                    [acct_obj.inv_addr2, attr_or_blank('inv_addr2')],
-                    ['{}, {} {}'.format(*attrgetter(*inv_addr_args)(acct_obj)),
-                     '{}, {} {}'.format(*attrgetter(*inv_addr_args)(provider_obj)) if provider_obj is not None else ''],
-                    ['', attr_or_blank('email')],
-                    ['', ''],
-                    [acct_obj.email, ici.contact_name],
-                    ['', ici.contact_title],
-                ]
-                # Building job table
-                jobs_table_data = [['Job ID No', 'Enter Date', 'Ship Date', 'Patient Last, First Name', 'Price']]
-                jobs_df = acct_df[['job_id', 'enter_date', 'ship_date', 'patient_name', 'sales']]
-                jobs_table_data.extend(list(map(convert_to_currency, jobs_df.values.tolist())))
-                # Subtotal
-                total_data = [['', '', '', '', 'Subtotal:', currency(acct_obj.sales)]]
-                # Adding tax
-                totals_tablestyle_copy = deepcopy(totals_tablestyle)
-                tax, row = acct_obj.tax, 1
-                if tax:
-                    row += 1
-                    total_data.append(['', '', '', '',
-                                       r'{:.2f}% Sales Tax:'.format(acct_obj.tax_rate * 100),
-                                       currency(tax),
-                    ])
-                # Adding adjustments
-                adj_df = adjustments[acct_no]
-                if isinstance(adj_df, pd.DataFrame):
-                    adj_sum = adj_df.amount.sum()
-                    totals_tablestyle_copy.add('FONT', (0, row), (-1, row), 'Helvetica-Bold')
-                    totals_tablestyle_copy.add('LINEBELOW', (0, row), (-3, row), 1, colors.black)
-                    total_data.append(['Adjustment', 'Reference No', 'Description', 'Amount'])
-                    total_data.extend(list(map(convert_to_currency, adj_df.values.tolist())))
-                    total_data.extend([
-                        [''] * 6,
-                        ['', '', '', '', 'Adjustment Total:', currency_or_blank(adj_sum)],
-                    ])
-                else:
-                    adj_sum = 0
-                # Adding invoice grand total
-                total_data.append(['', '', '', '', 'Invoice Total:', currency(Dec(acct_obj.total) + adj_sum)])
-                # Building story object
-                total_pages = compute_total_pages(jobs_table_data, total_data)
-                story = [
-                    InvoiceImage(image_path, total_pages=total_pages, acct=acct_no, **image_dims),
-                    P('Illinois Correctional Industries<br/>Invoice', h1),
-                    P('<u>SEND PAYMENT TO:</u>', h3),
-                    payment_info_paragraph,
-                    T(info_table_data, **info_table_kwargs),
-                    T(addr_table_data, **addr_table_kwargs),
-                    T(jobs_table_data, **jobs_table_kwargs),
-                    T(total_data, **totals_table_kwargs, style=totals_tablestyle_copy),
-                    PageBreak(),
-                ]
-                stories.extend(deepcopy(story))
-                invoice_path = os.path.join(save_to, '{}.pdf'.format(invoice_no))
-                invoice_doc = InvoiceTemplate(invoice_path, **invoice_doc_kwargs)
-                invoice_doc.build(story)
-        # Creating and building invoices doc
+        stories, invoice_paths, pickled_stories = [], [], []
+        # Generating each invoice story, slicing each account's jobs by position since billing data is sorted by
+        # provider and account
+        acct_groups = billing_data.groupby(['provider', 'acct'], observed=True, sort=False)
+        acct_totals = acct_groups[['sales', 'tax']].sum()
+        acct_totals['jobs'] = acct_groups.size()
+        acct_start, last_provider_id = 0, None
+        for (provider_id, acct_no), acct_sales, acct_tax, job_count in acct_totals.itertuples():
+            acct_df = billing_data.iloc[acct_start:acct_start + job_count]
+            acct_start += job_count
+            if provider_id != last_provider_id:
+                last_provider_id = provider_id
+                provider_obj = get_object(all_providers, provider_id)
+                attr_or_blank = lambda attr: getattr(provider_obj, attr, '')
+            invoice_no = digits_regex.search(invoice_nos[acct_no])
+            if invoice_no is None:
+                continue
+            invoice_no = invoice_no.group()
+            acct_obj = get_object(all_accounts, acct_no)
+            set_totals(acct_obj, acct_sales, acct_tax)
+            macola = acct_obj.macola_No if provider_obj is None else provider_obj.macola_No
+            info_table_data = [
+                ['Invoice Period:', inv_period],
+                ['Invoice Date:', inv_date],
+                ['Invoice No:', invoice_no],
+                ['Customer Account No:', macola],
+            ]
+            # Adding invoice and bill-to addresses
+            inv_addr_args = ('inv_city', 'inv_state', 'inv_zip')
+            addr_table_data = [
+                ['{} #{}'.format(acct_obj.name, acct_obj.account_No), attr_or_blank('name')],
+                [acct_obj.inv_addr1, attr_or_blank('inv_addr1')],
+                [acct_obj.inv_addr2, attr_or_blank('inv_addr2')],
+                ['{}, {} {}'.format(*attrgetter(*inv_addr_args)(acct_obj)),
+                 '{}, {} {}'.format(*attrgetter(*inv_addr_args)(provider_obj)) if provider_obj is not None else ''],
+                ['', attr_or_blank('email')],
+                ['', ''],
+                [acct_obj.email, ici.contact_name],
+                ['', ici.contact_title],
+            ]
+            # Building job table
+            jobs_table_data = [['Job ID No', 'Enter Date', 'Ship Date', 'Patient Last, First Name', 'Price']]
+            jobs_df = acct_df[['job_id', 'enter_date', 'ship_date', 'patient_name', 'sales']]
+            jobs_table_data.extend(jobs_df.assign(sales=jobs_df.sales.map(currency_or_blank)).values.tolist())
+            # Subtotal
+            total_data = [['', '', '', '', 'Subtotal:', currency(acct_obj.sales)]]
+            # Adding tax, the shared totals style is only copied when adjustments need extra commands
+            totals_style = totals_tablestyle
+            tax, row = acct_obj.tax, 1
+            if tax:
+                row += 1
+                total_data.append(['', '', '', '',
+                                   r'{:.2f}% Sales Tax:'.format(acct_obj.tax_rate * 100),
+                                   currency(tax),
+                ])
+            # Adding adjustments
+            adj_df = adjustments[acct_no]
+            if isinstance(adj_df, pd.DataFrame):
+                adj_sum = adj_df.amount.sum()
+                totals_style = TableStyle([
+                    ('FONT', (0, row), (-1, row), 'Helvetica-Bold'),
+                    ('LINEBELOW', (0, row), (-3, row), 1, colors.black),
+                ], parent=totals_tablestyle)
+                total_data.append(['Adjustment', 'Reference No', 'Description', 'Amount'])
+                total_data.extend(adj_df.assign(amount=adj_df.amount.map(currency_or_blank)).values.tolist())
+                total_data.extend([
+                    [''] * 6,
+                    ['', '', '', '', 'Adjustment Total:', currency_or_blank(adj_sum)],
+                ])
+            else:
+                adj_sum = 0
+            # Adding invoice grand total
+            total_data.append(['', '', '', '', 'Invoice Total:', currency(acct_obj.total + adj_sum)])
+            # Building story object
+            total_pages = compute_total_pages(jobs_table_data, total_data)
+            story = [
+                InvoiceImage(image_path, total_pages=total_pages, acct=acct_no, **image_dims),
+                invoice_header_paragraph,
+                payment_header_paragraph,
+                payment_info_paragraph,
+                T(info_table_data, **info_table_kwargs),
+                T(addr_table_data, **addr_table_kwargs),
+                T(jobs_table_data, **jobs_table_kwargs),
+                T(total_data, **totals_table_kwargs, style=totals_style),
+                PageBreak(),
+            ]
+            # Flowables are shared with the combined document since each worker builds from its own pickled copy
+            stories.extend(story)
+            invoice_paths.append(os.path.join(save_to, '{}.pdf'.format(invoice_no)))
+            # Pickling up front so an unpicklable flowable fails here instead of in the executor's feeder thread
+            pickled_stories.append(pickle.dumps(story, pickle.HIGHEST_PROTOCOL))
+        # Saving each invoice file in worker processes, which never touch the database, while the combined
+        # invoices doc is built here from the original flowables
+        buffer = BytesIO()
+        with ProcessPoolExecutor(max_workers=invoice_build_workers) as executor:
+            invoice_files = executor.map(build_invoice_file, invoice_paths, pickled_stories, repeat(invoice_doc_kwargs))
+            InvoiceTemplate(buffer, **invoice_doc_kwargs).build(stories)
+            list(invoice_files)
         filename = '{} {} Invoices.pdf'.format(inv_period, cat_des)
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename={}'.format(filename)
-        invoices_doc = InvoiceTemplate(response, **invoice_doc_kwargs)
-        invoices_doc.build(stories)
         # Saving new starting invoice number
-        invoice_seq, last_inv_regex = [], re_compile(r'\d+')
-        [invoice_seq.extend(last_inv_regex.findall(inv)) for inv in invoice_nos.values()]
-        last_invoice_no = max(invoice_seq)
+        invoice_seq = pd.Series(list(invoice_nos.values())).str.extractall(digits_regex)[0]
+        last_invoice_no = invoice_seq[invoice_seq.astype('int64').idxmax()]
         category_obj.invoice_start = '{}{:0>4}'.format(last_invoice_no[:-4], int(last_invoice_no[-4:]) + 1)
         category_obj.save()
-        return response
+        return attachment_response(buffer, filename)
     
     def summary(self, billing_data, adjustments, invoice_nos):
         """
@@ -629,60 +870,39 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
         """
         invoice_date = self.savepath_clean_data['invoice_date'].strftime('%B %Y')
         username = self.request.user.username
-        all_providers, all_accounts = attrgetter('all_providers', 'all_accounts')(self)
-        font_size = 10
-        header = {
-            'bold': True,
-            'font_size': font_size,
-            'text_h_align': 2,
-            'text_v_align': 2,
-            'text_wrap': True,
-            'top': 2,
-            'bottom': 2,
-            'right': 2,
-            'left': 2,
-        }
-        normal = {'font_size': font_size, 'text_h_align': 2, 'text_v_align': 2}
-        total = {
-            'font_size': font_size,
-            'bold': True,
-            'text_h_align': 2,
-            'num_format': '#,##0',
-            'text_v_align': 2,
-        }
-        money = {
-            'font_size': font_size,
-            'text_h_align': 2,
-            'num_format': '$#,##0.00_);($#,##0.00)',
-            'text_v_align': 2,
-        }
-        total_money = dict(money, bold=True)
-        col_headers = (
-            'Invoice No',
-            'Account No',
-            'Shipped To',
-            'Job ID No',
-            'Patient Name',
-            'Frame Style',
-            'Ship Date',
-            'Lens Price',
-            'Frame Price',
-            'Total Price',
-        )
+        all_providers, all_accounts = self.all_providers, self.all_accounts
+        write_summary_job = self.write_summary_job
         header_text = '&C&18&"Arial,Bold"{} ({})\nEyeglass Billing Summary - {}'
         filename = '{} Billing Summary'.format(invoice_date)
-        response = HttpResponse(content_type='application/xlsx')
-        response['Content-Disposition'] = 'attachment; filename={}.xlsx'.format(filename)
-        wb = Workbook(response)
-        for provider_id, provider_df in billing_data.groupby('provider'):
-            p = all_providers.get(pk=provider_id)
+        # Rows are flushed to disk as they are written, so each sheet must be written top to bottom
+        buffer = BytesIO()
+        wb = Workbook(buffer, {'constant_memory': True})
+        wb.set_properties({'title': filename, 'subject': filename, 'author': username})
+        header_format, normal_format, total_format, money_format, total_money_format = map(
+            wb.add_format, summary_format_props)
+        # Leaving out accounts without invoice numbers before any grouping
+        invoiced_accts = [acct_no for acct_no, invoice_no in invoice_nos.items() if invoice_no]
+        billing_data = billing_data[billing_data.acct.isin(invoiced_accts)]
+        # Choosing which frame name to display for every job at once: the comment for stock or patient-supplied
+        # frames, the secondary name for frames without an item number, and the frame name otherwise
+        is_stock = billing_data.patient_name.str.contains('stock|frame', case=False, na=False)
+        has_item_no = billing_data.frame_item_no.fillna('').astype(bool)
+        item_frame = billing_data.frame_name.where(has_item_no, billing_data.frame_name2)
+        billing_data = billing_data.assign(disp_frame=item_frame.mask(is_stock, billing_data.comment1))
+        job_columns = ['job_id', 'patient_name', 'disp_frame', 'ship_date', 'lens_price', 'frame_price', 'sales']
+        # Data cells are written without a format so they pick up these column formats
+        col_widths_formats = (
+            ('A:B', None, normal_format),
+            ('C:C', 17, normal_format),
+            ('D:D', None, normal_format),
+            ('E:E', 25, normal_format),
+            ('F:F', 20, normal_format),
+            ('G:G', 12, normal_format),
+            ('H:J', 10, money_format),
+        )
+        for provider_id, provider_df in billing_data.groupby('provider', observed=True, sort=False):
+            p = all_providers[provider_id]
             short_name = p.short_name or p.name[:10]
-            header_format = wb.add_format(header)
-            normal_format = wb.add_format(normal)
-            total_format = wb.add_format(total)
-            money_format = wb.add_format(money)
-            total_money_format = wb.add_format(total_money)
-            wb.set_properties({'title': filename, 'subject': filename, 'author': username})
             ws = wb.add_worksheet(short_name)
             ws.set_landscape()
             ws.center_horizontally()
@@ -693,53 +913,25 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
             ws.repeat_rows(0)
             ws.set_default_row(13)
             ws.set_row(0, 26)
-            cols_widths = (
-                ('C:C', 17),
-                ('E:E', 25),
-                ('F:F', 20),
-                ('G:G', 12),
-                ('H:J', 10),
-            )
-            [ws.set_column(cols, width) for cols, width in cols_widths]
-            ws.write_row(0, 0, col_headers, cell_format=header_format)
+            for cols, width, col_format in col_widths_formats:
+                ws.set_column(cols, width, col_format)
+            ws.write_row(0, 0, summary_col_headers, cell_format=header_format)
             row, row_range = 1, [2]
-            for acct_no, acct_df in provider_df.groupby('acct'):
-                invoice_no, acct_adjs = invoice_nos['acct_no'], adjustments['acct_no']
-                if not invoice_no:
-                    continue
-                acct = all_accounts.get(account_No=acct_no)
-                name = acct.short_name or acct.name
-                for j in acct_df.to_dict(orient='records'):
-                    patient_name = j['patient_name']
-                    if ('stock' or 'frame') in patient_name.lower():
-                        disp_frame = j['comment1']
-                    elif not j['frame_item_no']:
-                        disp_frame = j['frame_name2']
-                    else:
-                        disp_frame = j['frame_name']
-                    row_data = (
-                        invoice_no,
-                        acct_no,
-                        name,
-                        j['job_id'],
-                        patient_name,
-                        disp_frame,
-                        j['ship_date'],
-                    )
-                    ws.write_row(row, 0, row_data, normal_format)
-                    ws.write_row(row, 7, itemgetter('lens_price', 'frame_price', 'sales')(j),
-                                 cell_format=money_format)
+            # Each account's jobs are contiguous since billing data is sorted by provider and account
+            job_rows = provider_df[job_columns].itertuples(index=False, name=None)
+            for acct_no, job_count in provider_df.groupby('acct', observed=True, sort=False).size().items():
+                invoice_no, acct_adjs = invoice_nos[acct_no], adjustments[acct_no]
+                acct = all_accounts[acct_no]
+                # Blanking nulls once per account since write_string rejects them but writes empty strings as blanks
+                acct_info = tuple('' if pd.isna(v) else v for v in (invoice_no, acct_no, acct.short_name or acct.name))
+                for job in islice(job_rows, job_count):
+                    write_summary_job(ws, row, acct_info, job)
                     row += 1
                 if acct_adjs is not None:
-                    for adj in acct_adjs.to_dict(orient='records'):
-                        adj_data = (
-                            invoice_no,
-                            acct_no,
-                            name,
-                            *itemgetter('ref', 'des', 'kind')(adj),
-                        )
-                        ws.write_row(row, 0, adj_data, cell_format=normal_format)
-                        ws.write_number(row, 9, adj['amount'], cell_format=money_format)
+                    adj_rows = acct_adjs[['ref', 'des', 'kind', 'amount']].itertuples(index=False, name=None)
+                    for ref, des, kind, amount in adj_rows:
+                        ws.write_row(row, 0, acct_info + (ref, des, kind))
+                        ws.write_number(row, 9, amount)
                         row += 1
             row_range.append(row)
             ws.write_string(row, 4, 'TOTAL PATIENTS:', cell_format=total_format)
@@ -750,7 +942,8 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
                 '=SUM(J{}:J{})'.format(*row_range),
             )
             ws.write_row(row, 7, formulas, cell_format=total_money_format)
-        return response
+        wb.close()
+        return attachment_response(buffer, '{}.xlsx'.format(filename), content_type='application/xlsx')
     
     def credit(self, billing_data, adjustments, invoice_nos):
         """
@@ -762,24 +955,11 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
         """
         # Getting general info
         acct_no = self.request.POST['_credit'].split()[-1]
-        acct_adjs_df, acct_inv_no = adjustments['acct_no'], invoice_nos['acct_no']
+        acct_adjs_df, acct_inv_no = adjustments[acct_no], invoice_nos[acct_no]
         ici = self.get_ici_account()
         contact_name = ici.contact_name
         # Creating styling objects
-        normal, h2, h4 = attrgetter('normal', 'h2', 'h4')(self)
-        h2.alignment = 0
-        info_table_style = TableStyle([
-            ('FONT', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 14),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ])
-        adj_table_style = TableStyle([
-            ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 14),
-            ('ALIGNMENT', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('LINEBELOW', (0, 0), (-1, 0), 1, colors.black),
-        ])
+        h2, h4 = credit_h2, self.h4
         # Creating data objects
         half_inch = 0.5 * inch
         ici_info = [
@@ -797,24 +977,22 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
             ['Subject', 'Credit Memo Request'],
         ]
         adj_table_info = [['Adjustment Type', 'Reference No', 'Description', 'Amount']]
-        adj_table_info.extend(list(map(self.convert_to_currency, acct_adjs_df.values)))
+        adj_table_info.extend(map(self.convert_to_currency, acct_adjs_df.itertuples(index=False, name=None)))
         # Creating story object
         story = [
             Image(self.get_ici_logo_path(), width=1.2 * inch, height=half_inch, hAlign='LEFT'),
             P('<br/>'.join(ici_info), h4),
-            P('MEMORANDUM', h2),
-            T(info_table_data, style=info_table_style, hAlign='LEFT'),
+            static_paragraph('MEMORANDUM', h2),
+            T(info_table_data, style=memo_info_tablestyle, hAlign='LEFT'),
             P('Please issue the following credit memo for account {} related to the invoice(s) listed below. '
               'Where applicable, this memo is to be broken down as follows:'.format(acct_no), h2),
-            T(adj_table_info, style=adj_table_style, hAlign='LEFT'),
+            T(adj_table_info, style=credit_adj_tablestyle, hAlign='LEFT'),
             P('Thank you<br/>{}, {}<br/>Dixon Optical Lab, 0562'.format(contact_name, ici.contact_title), h2),
         ]
         # Creating response
-        response = HttpResponse(content_type='application/pdf')
-        filename = 'Credit Request for {}.pdf'.format(acct_no)
-        response['Content-Disposition'] = 'attachment; filename={}'.format(filename)
+        buffer, filename = BytesIO(), 'Credit Request for {}.pdf'.format(acct_no)
         credit_doc = SimpleDocTemplate(
-            response,
+            buffer,
             leftMargin=half_inch,
             rightMargin=half_inch,
             topMargin=half_inch,
@@ -824,7 +1002,7 @@ class BillingInvoiceFormView(FormView, BillingAppViewMixin):
             title='Credit Request for {}'.format(acct_no),
         )
         credit_doc.build(story)
-        return response
+        return attachment_response(buffer, filename)
 
 
 class MacolaRequestFormView(FormView):
@@ -835,14 +1013,12 @@ class MacolaRequestFormView(FormView):
     template_name = 'billing/macola_request.html'
     initial = {'req_date': today, 'acct_type': 'Regular Account'}
 
-    def get_form_kwargs(self):
+    def get_form_class(self):
         """
-        Override building of form kwargs to account for url kwargs
-        :return: dict
+        Select form class from url kwargs, only asking for address info when no account number is passed in
+        :return: Form class
         """
-        form_kwargs, acct_no = super(MacolaRequestFormView, self).get_form_kwargs(), self.kwargs['acct']
-        form_kwargs.update(acct_no=None if acct_no == 'none' else acct_no)
-        return form_kwargs
+        return bf.MacolaRequestAddressForm if self.kwargs['acct'] == 'none' else bf.MacolaRequestForm
     
     def form_valid(self, form):
         """
@@ -864,19 +1040,7 @@ class MacolaRequestFormView(FormView):
         else:
             acct = dict(cd, account_No=acct_no)
         # Creating styling
-        styles = getSampleStyleSheet()
-        h1 = styles['Heading1']
-        h1.alignment, black = 1, colors.black
-        form_style = TableStyle([
-            ('BOX', (0, 3), (-1, 3), 1, black),
-            ('BOX', (0, 5), (-1, 6), 1, black),
-            ('BOX', (0, 8), (-1, 16), 1, black),
-            ('BOX', (0, -4), (-1, -1), 1, black),
-            ('FONT', (0, 0), (-1, 5), 'Helvetica-Bold'),
-            ('FONT', (0, 8), (0, 18), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, -4), (-1, -1), 8),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ])
+        h1 = macola_request_h1
         # Creating document data
         blank_row, tax_exempt = [''] * 2, acct['tax_exemption']
         address_info = itemgetter('inv_addr1', 'inv_addr2', 'inv_city', 'inv_State', 'inv_zip')(acct)
@@ -919,16 +1083,14 @@ class MacolaRequestFormView(FormView):
         ])
         # Creating story
         story = [
-            P('New Macola Account Request Form', h1),
-            T(table_data, style=form_style, colWidths=(3.5 * inch, 3.9 * inch), rowHeights=0.4 * inch),
+            static_paragraph('New Macola Account Request Form', h1),
+            T(table_data, style=macola_request_tablestyle, colWidths=(3.5 * inch, 3.9 * inch), rowHeights=0.4 * inch),
         ]
         # Creating and returning response
-        response = HttpResponse(content_type='application/pdf')
-        filename = 'Macola Request for Account {}.pdf'.format(acct_no)
-        response['Content-Disposition'] = 'attachment; filename={}'.format(filename)
+        buffer, filename = BytesIO(), 'Macola Request for Account {}.pdf'.format(acct_no)
         half_inch = 0.5 * inch
         req_form = SimpleDocTemplate(
-            response,
+            buffer,
             topMargin=half_inch,
             bottomMargin=half_inch,
             rightMargin=half_inch,
@@ -937,7 +1099,7 @@ class MacolaRequestFormView(FormView):
             title='Macola Request Form',
         )
         req_form.build(story)
-        return response
+        return attachment_response(buffer, filename)
 
 
 class CreditRequestFormView(FormView, BillingAppViewMixin):
@@ -947,7 +1109,7 @@ class CreditRequestFormView(FormView, BillingAppViewMixin):
     form_class = bf.CreditRequestForm
     template_name = 'billing/credit_request_form.html'
     initial = {'req_date': today, 'credit_no': 1}
-    credit_formset = formset_factory(bf.CreditAdjustmentForm, extra=10)
+    credit_formset = bf.get_formset(bf.CreditAdjustmentForm, extra=10)
 
     def get_context_data(self, **kwargs):
         """
@@ -971,31 +1133,18 @@ class CreditRequestFormView(FormView, BillingAppViewMixin):
         if isinstance(credit_df, credit_formset):
             form.add_error(None, 'At least 1 adjustment form is incomplete')
             return self.form_invalid(form)
-        reindexed_credit_df = credit_df.reindex_axis(['inv_no', 'sales', 'tax'], axis=1)
+        reindexed_credit_df = credit_df.reindex(columns=['inv_no', 'sales', 'tax'])
         reindexed_credit_df['total'] = credit_df.sales + credit_df.tax
         reindexed_credit_df['reason'] = credit_df.reason
         reindexed_credit_df['memo'] = ''
-        [reindexed_credit_df.__setitem__(col, reindexed_credit_df[col].map(currency_or_blank))
-         for col in ('sales', 'tax', 'total')]
+        currency_cols = ['sales', 'tax', 'total']
+        reindexed_credit_df[currency_cols] = reindexed_credit_df[currency_cols].apply(
+            lambda col: col.map(currency_or_blank))
         # Getting general info
         acct_no, contact_name = itemgetter('acct', 'req_person')(cd)
         ici, half_inch = BillingInvoiceFormView.get_ici_account(), 0.5 * inch
         # Creating styling objects
-        normal, h2, h4 = itemgetter('Normal', 'Heading2', 'Heading4')(getSampleStyleSheet())
-        h2.spaceBefore = half_inch
-        h2.alignment, h4.alignment = 4, 2
-        info_table_style = TableStyle([
-            ('FONT', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 14),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ])
-        adj_table_style = TableStyle([
-            ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('ALIGNMENT', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('LINEBELOW', (0, 0), (-1, 0), 1, colors.black),
-        ])
+        h2, h4 = credit_request_h2, credit_request_h4
         # Creating data objects
         ici_info = [
             *attrgetter('name', 'inv_addr1', 'inv_addr2')(ici),
@@ -1012,24 +1161,23 @@ class CreditRequestFormView(FormView, BillingAppViewMixin):
             ['Subject:', 'Credit Memo Request CR-562-{}-{}'.format(today, cd['credit_no'])],
         ]
         adj_table_info = [['Invoice', 'Sales', 'Tax', 'Total', 'Reason', 'Memo No']]
-        adj_table_info.extend(list(map(BillingInvoiceFormView.convert_to_currency, reindexed_credit_df.values)))
+        credit_rows = reindexed_credit_df.itertuples(index=False, name=None)
+        adj_table_info.extend(map(BillingInvoiceFormView.convert_to_currency, credit_rows))
         # Creating story object
         story = [
             Image(self.get_ici_logo_path(), width=1.2 * inch, height=half_inch, hAlign='LEFT'),
             P('<br/>'.join(ici_info), h4),
-            P('MEMORANDUM', h2),
-            T(info_table_data, style=info_table_style, hAlign='LEFT'),
+            static_paragraph('MEMORANDUM', h2),
+            T(info_table_data, style=memo_info_tablestyle, hAlign='LEFT'),
             P('Please issue the following credit memo for account {} related to the invoice(s) listed below. '
               'Where applicable, this memo is to be broken down as follows:'.format(acct_no), h2),
-            T(adj_table_info, style=adj_table_style, hAlign='LEFT'),
+            T(adj_table_info, style=credit_request_adj_tablestyle, hAlign='LEFT'),
             P('Thank you,<br/>{}<br/>Dixon Optical Lab, 562'.format(contact_name), h2),
         ]
         # Creating response
-        response = HttpResponse(content_type='application/pdf')
-        filename = 'Credit Request for {}.pdf'.format(acct_no)
-        response['Content-Disposition'] = 'attachment; filename={}'.format(filename)
+        buffer, filename = BytesIO(), 'Credit Request for {}.pdf'.format(acct_no)
         credit_doc = SimpleDocTemplate(
-            response,
+            buffer,
             leftMargin=half_inch,
             rightMargin=half_inch,
             topMargin=half_inch,
@@ -1039,5 +1187,5 @@ class CreditRequestFormView(FormView, BillingAppViewMixin):
             title='Credit Request for {}'.format(acct_no),
         )
         credit_doc.build(story)
-        return response
+        return attachment_response(buffer, filename)
     